@@ -9,19 +9,84 @@ changing scheduled playouts. Requires the playsound module for audio
 playout which in turn uses windll.winm on Windows, AppKit.NSSound
 on Apple OS, or GStreamer on Linux. The Playsound module for Python2 is
 incompatible with that for Python3, so if Python2 is present on the
-target system, playsound must be installed with 'pip3 install playsound'"""
+target system, playsound must be installed with 'pip3 install playsound'.
+If the pydub and simpleaudio modules are also installed, scheduled files
+are decoded into memory beforehand and played from there, so that playout
+starts on time without first decoding the file."""
 
 # D.L. Poole July 2021
 
 
-import threading
-import time
+import datetime
+import heapq
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import sys
 from playsound import playsound
 
+# Optional preloading and playout of decoded audio
+try:
+    from pydub import AudioSegment
+    import simpleaudio
+except ImportError:
+    AudioSegment = simpleaudio = None
+
 # The file path is prepended to user given file names.  It will be
 # platform and installation-dependent
 file_path = "/home/dave/Carillon/"
 
+# The schedule is saved here after every change and reloaded at startup
+schedule_file = file_path + "schedule.json"
+
+def resolve_paths(file):
+    """Resolve a tune name to the full path(s) of the file(s) to be played.
+
+    A file name has the path prepended and .mp3 appended unless already
+    present. The Strike keyword resolves to a list of the twelve Strikehh
+    file paths, indexed by the hour to strike less one."""
+
+    if file.lower() == "strike":
+        return [file_path+"Strike"+str(i+1)+".mp3" for i in range(12)]
+    if file.lower().endswith(".mp3"):
+        return file_path+file
+    return file_path+file+".mp3"
+
+def complete_event(event):
+    """Append the fields playout uses to an event of seven user-given fields.
+
+    These are the resolved file path(s), the frozenset of weekday numbers
+    the event may play on, which is every weekday for an event on a hard
+    date, and the hard date as an integer (year, month, day) tuple or None.
+    Return the event."""
+
+    event.append(resolve_paths(event[6]))
+    if event[0] != "":
+        event.append(frozenset(range(7)))
+        month, day, year = event[0].split("/")
+        event.append((2000+int(year), int(month), int(day)))
+    else:
+        event.append(frozenset(range(event[1], event[2]+1)))
+        event.append(None)
+    return event
+
+def parse_int(text, lo, hi):
+    """Parse an integer user-input field and check it lies in lo..hi inclusive.
+
+    Return the integer, or None if the field is not numeric or out of range."""
+
+    # Only plain ASCII digits, as int() would also take e.g. " 5", "+5", "1_5"
+    # and non-ASCII digits
+    if not (text.isascii() and text.isdigit()):
+        return None
+    value = int(text)
+    if lo <= value <= hi:
+        return value
+    return None
+
 # The schedule is an unordered list of playout events
 # Default schedule for a tower clock
 schedule=[]
@@ -30,28 +95,443 @@ schedule.append(["",0,6,0,23,0,"Strike"])
 schedule.append(["",0,6,0,23,15,"Quarter"])
 schedule.append(["",0,6,0,23,30,"Half"])
 schedule.append(["",0,6,0,23,45,"ThreeQuarter"])
+# Complete the default events once, as main() does for user events
+for event in schedule:
+    complete_event(event)
+
+# The schedule heap holds a (time, line#, event) entry for the next time each
+# event is to play, so playout need only wait on the earliest. It is rebuilt
+# whole after every change to the schedule
+schedule_heap = []
+
+# Playout runs in its own process, which is the sole owner of the schedule list
+# and its heap. The UI never changes them itself but queues numbered
+# ("add", line#, event) or ("del", line#) commands. After applying changes the
+# playout process returns a copy of its schedule, with the number of the last
+# command applied, which the UI keeps for display
+cmd_q = multiprocessing.Queue()
+state_q = multiprocessing.Queue()
+# Number of the last command sent by the UI or applied by playout
+last_command = 0
+
+def next_fire_after(after, event):
+    """Return the first whole minute later than after that the event is to play.
+
+    Return None if the event is never to play again, e.g. its hard date has
+    passed or does not exist."""
+
+    # An event on a hard date may only play that day, otherwise try each day
+    # of the coming week for one of its weekdays
+    if event[9] != None:
+        try:
+            days = [datetime.date(*event[9])]
+        except ValueError:
+            return None
+    else:
+        days = [after.date() + datetime.timedelta(days = n) for n in range(8)]
+    for day in days:
+        # Sunday is weekday 0 as in day_dict
+        if day.isoweekday() % 7 not in event[8]:
+            continue
+        for hour in range(event[3], event[4]+1):
+            fire_time = datetime.datetime(day.year, day.month, day.day,
+                                          hour, event[5])
+            if fire_time > after:
+                return fire_time
+    return None
+
+def rebuild_heap(after):
+    """Rebuild the schedule heap with each event's first playout later than after.
+
+    Call after any change to the schedule list."""
+
+    heap = []
+    for i, event in enumerate(schedule):
+        fire_time = next_fire_after(after, event)
+        if fire_time != None:
+            heap.append((fire_time, i, event))
+    heapq.heapify(heap)
+    schedule_heap[:] = heap
+
+def send_command(*command):
+    """Queue a schedule change for the playout process and await its schedule.
+
+    The change is normally applied at once. If a playout is in progress it
+    is applied when that playout ends, and the user is told so."""
+
+    global last_command
+    last_command += 1
+    cmd_q.put((last_command, command))
+    # Wait for a copy of the schedule with this change applied
+    while True:
+        try:
+            applied, schedule[:] = state_q.get(timeout = 1)
+        except queue.Empty:
+            print("Change pending until the current playout ends")
+            return
+        if applied >= last_command:
+            return
+
+def receive_schedule():
+    """Keep the latest copy of the schedule returned by the playout process."""
+
+    while True:
+        try:
+            applied, schedule[:] = state_q.get_nowait()
+        except queue.Empty:
+            return
+
+def return_schedule():
+    """Save the schedule and return a copy to the UI. Called only by playout."""
+
+    save_schedule()
+    state_q.put((last_command, schedule))
+
+def save_schedule():
+    """Save the schedule to the schedule file, replacing it atomically.
+
+    Only the seven user-given fields are saved, and the rest are derived
+    again when loaded."""
+
+    temp_file = schedule_file + ".tmp"
+    try:
+        with open(temp_file, "w") as f:
+            json.dump([event[:7] for event in schedule], f)
+        os.replace(temp_file, schedule_file)
+    except OSError as e:
+        print("Error: Schedule could not be saved:", e)
+
+def load_schedule():
+    """Replace the default schedule with one saved by a previous run, if any.
+
+    Each saved event must pass the same validation as a user's entry. Invalid
+    events, e.g. those whose tune file is missing, are displayed and skipped,
+    and the rest are loaded. If the file cannot be read at all the default
+    schedule is kept. Either way the saved file is first copied to a backup,
+    since the next change to the schedule saves over it."""
+
+    if not os.path.exists(schedule_file):
+        return
+    try:
+        with open(schedule_file) as f:
+            saved = json.load(f)
+        if type(saved) != list:
+            raise ValueError("schedule must be a list of events")
+    except (OSError, ValueError) as e:
+        print("Error: Saved schedule could not be loaded:", e)
+        print("Using the default schedule")
+        backup_schedule()
+        return
+    events = []
+    for i, fields in enumerate(saved):
+        try:
+            if type(fields) != list:
+                raise ValueError("not a list of fields")
+            event = parse_event(*event_fields(fields))
+        except ValueError as e:
+            print("Error:", e)
+            event = None
+        if event == None:
+            print("Error: Saved event ",i+1, fields," skipped")
+        else:
+            events.append(event)
+    if len(events) < len(saved):
+        backup_schedule()
+    schedule[:] = events
+
+def backup_schedule():
+    """Copy the saved schedule file to a backup that later saves leave alone."""
+
+    backup_file = schedule_file + ".bak"
+    try:
+        shutil.copyfile(schedule_file, backup_file)
+        print("The saved schedule is kept as", backup_file)
+    except OSError as e:
+        print("Error: Saved schedule could not be backed up:", e)
+
+def apply_command(command):
+    """Apply a queued schedule change. Called only by playout."""
+
+    if command[0] == "del":
+        line_number = command[1]
+        # If there is anything to delete, delete it
+        if len(schedule) >0:
+            if 0 < line_number <= len(schedule):
+                schedule.pop(line_number-1)
+            else:
+                print("No line ",line_number," to delete")
+    elif command[0] == "add":
+        line_number, event = command[1], command[2]
+        # Append the event to or insert into in the schedule
+        if line_number-1 >= len(schedule):
+            schedule.append(event)
+        else:
+            schedule[line_number-1] = event
+
+def apply_commands(timeout = 0):
+    """Apply queued schedule changes, waiting up to timeout seconds for the first.
+
+    Return whether any change was applied."""
+
+    global last_command
+    applied = False
+    while True:
+        try:
+            last_command, command = cmd_q.get(timeout = timeout) if timeout > 0 \
+                                    else cmd_q.get_nowait()
+        except queue.Empty:
+            break
+        apply_command(command)
+        applied = True
+        # Only the first command is waited for, the rest are drained
+        timeout = 0
+    if applied:
+        return_schedule()
+        preload_audio()
+    return applied
+
+# The playout process keeps the decoded audio of scheduled files here, keyed by
+# path, as (pcm data, channels, sample width, frame rate). Files larger than
+# preload_limit bytes, e.g. long peals, are left to playsound to save memory
+audio_cache = {}
+preload_limit = 1000000
+
+def preload_audio():
+    """Decode the schedule's files into memory ahead of their playout.
+
+    Called only by playout whenever the schedule changes. Files no longer
+    scheduled are dropped. Does nothing unless pydub and simpleaudio are
+    installed, and files that are too large or fail to decode are left to
+    playsound."""
+
+    if AudioSegment is None:
+        return
+    paths = set()
+    for event in schedule:
+        if event[6] == "Strike":
+            paths.update(event[7])
+        else:
+            paths.add(event[7])
+    for path in list(audio_cache):
+        if path not in paths:
+            del audio_cache[path]
+    for path in paths - audio_cache.keys():
+        try:
+            if os.path.getsize(path) > preload_limit:
+                continue
+            segment = AudioSegment.from_mp3(path)
+        except Exception:
+            continue
+        audio_cache[path] = (segment.raw_data, segment.channels,
+                             segment.sample_width, segment.frame_rate)
+
+def play(file_name):
+    """Play a file from memory if preloaded, else with playsound.
+
+    Playing from memory is only an optimization, so should it fail, e.g. the
+    audio device is busy, the file is played with playsound instead. Return
+    only when play is done."""
+
+    audio = audio_cache.get(file_name)
+    if audio != None:
+        try:
+            simpleaudio.play_buffer(*audio).wait_done()
+            return
+        except Exception:
+            pass
+    playsound(file_name)
 
 # Weekday List and Dictionary for validation/encoding of user input
 day_list = ['su','mo','tu','we','th','fr','sa']
 day_dict = {'su':0,'mo':1,'tu':2,'we':3,'th':4,'fr':5,'sa':6}
 
+def parse_event(day_text, hours_text, minute, file):
+    """Parse and validate the day, hour, minute and tune fields of an event.
+
+    The fields are strings as entered by the user after the line number.
+    Display an error and return None if any is invalid, otherwise return
+    the completed event list."""
+
+    # The first field is date, weekday, or weekday range
+    # User entered a hard date as mm/dd/yy
+    if "/" in day_text:
+        if len(day_text) != 8:
+            print("Error: Date must be mm/dd/yy")                       
+            return None
+        # Convert to integer for validation
+        month_field, sep, rest = day_text.partition("/")
+        day_field, sep, year_field = rest.partition("/")
+        month = parse_int(month_field, 1, 12)
+        if month == None:
+            print("Error: ", month_field, " is not a valid month")
+            return None
+        day = parse_int(day_field, 1, 31)
+        if day == None:
+            print("Error: ",day_field," is not a valid Day")
+            return None
+        year = parse_int(year_field, 21, 99)
+        if year == None:
+            print("Error: ",year_field," is not a valid Year")
+            return None
+        # The day must also exist in that month, e.g. not 02/30 or 02/29/27
+        try:
+            datetime.date(2000+year, month, day)
+        except ValueError:
+            print("Error: ",day_field," is not a valid Day")
+            return None
+        # Date is valid, but retrieve the string to save in event
+        date = day_text
+        # Make weekdays out of range to disable daily playout
+        start_day = end_day = 8
+    # User entered a weekday or weekday range e.g. su, su-sa, etc.
+    else:
+        # Weekday ranges are defined by a "-" delimiter
+        first_day, sep, last_day = day_text.partition("-")
+        # Convert first weekday in string to an integer start day index
+        start_day = day_dict.get(first_day)
+        # Default to a single weekday if not a weekday range
+        end_day = start_day
+        # Weekday lists not supported
+        if "-" in last_day:
+            print ("Error: Weekday list. Use multiple events instead")
+            return None
+        # Weekday range contains a second string
+        if sep:
+            # Convert second weekday in string to an integer end day index
+            end_day = day_dict.get(last_day)
+        # If the weekday is not in the dictionary
+        if start_day == None or end_day == None:
+            print ("Error: Day(s) must be su, mo, tu, we, th, fr or sa")
+            return None
+        # User specified weekday(s) so null the hard date field in event
+        date = ""
+    # The second field is an hour or hour range
+    start_hour, sep, end_hour = hours_text.partition("-")
+    # Hour lists not supported
+    if "-" in end_hour:
+        print ("Error: Hour range must be start-end")
+        return None
+    # An hour range is delimited by "-", otherwise default to single hour
+    if not sep:
+        end_hour = start_hour
+    # Convert start hour to integer for validation
+    value = parse_int(start_hour, 0, 23)
+    if value == None:
+        print ("Start Hour ",start_hour," must be a number between 0 and 23")
+        return None
+    start_hour = value
+    # Convert end hour to integer for validation
+    value = parse_int(end_hour, 0, 23)
+    if value == None:
+        print ("End Hour ", end_hour," must be a number between 0 and 23")
+        return None
+    end_hour = value
+    # The third field is a minute value, never a range
+    # Convert minute to integer for validation
+    value = parse_int(minute, 0, 59)
+    if value == None:
+        print ("Minute ",minute," must be a number between 0 and 59")
+        return None
+    minute = value
+    # The fourth field is a file name (.mp3 file) which must
+    # allow for embedded spaces or the "Strike" keyword
+    # Resolve the file(s) to be played, here for validation
+    paths = resolve_paths(file)
+    # The strike keyword is case insensitive and
+    # resolves to the twelve Strikehh files playout chooses from
+    if file.lower() == "strike":
+        file = "Strike"
+    # Striking requires twelve Strikehh files, all present and readable
+        missing = [file_name for file_name in paths
+                   if not (os.path.isfile(file_name) and
+                           os.access(file_name, os.R_OK))]
+        if missing:
+            for file_name in missing:
+                print("Error: File ", file_name," is missing")
+            return None
+    # Validate the user-supplied file name
+    else:
+        file_name = paths
+        if not os.path.isfile(file_name):
+            print("Error:", file_name," not found - check sPeLLing")
+            return None
+        if not os.access(file_name, os.R_OK):
+            print("Error: ", file_name," is not readable")
+            return None
+
+    # The fields are fully parsed and validated, with no return due to an error
+    # Build an event list to be inserted or appended to the schedule list
+    # An event is an ordered list of parameters of mixed types defining
+    # date, weekday or day range, hour or hour range, minute, and
+    # a filename or the keyword "Strike", then the fields derived for playout
+    event = []
+    event.append(date) # nul for day range or hard date as mm/dd/yy string
+    event.append(start_day) # int starting weekday number
+    event.append(end_day) # int ending weekday number
+    event.append(start_hour) # int starting hour
+    event.append(end_hour) # int ending hour
+    event.append(minute) # int minute
+    event.append(file) # file name as entered or "Strike" for display
+    # then full path or list of twelve Strike paths, weekday set and date
+    return complete_event(event)
+
+def event_fields(event):
+    """Return a saved event's seven fields as the four strings the user entered.
+
+    Raise ValueError if a field is not of the type and range parse_event()
+    produces, so that it may then be parsed again under the same rules."""
+
+    if len(event) != 7:
+        raise ValueError("event must have seven fields")
+    date, start_day, end_day, start_hour, end_hour, minute, file = event
+    for value in (start_day, end_day, start_hour, end_hour, minute):
+        if type(value) != int:
+            raise ValueError(str(value)+" is not an integer")
+    if type(date) != str or type(file) != str:
+        raise ValueError("date and tune must be strings")
+    if date != "":
+        if start_day != 8 or end_day != 8:
+            raise ValueError("an event on a hard date has no weekdays")
+        day_text = date
+    else:
+        if not (0 <= start_day <= 6 and 0 <= end_day <= 6):
+            raise ValueError("weekday numbers must be between 0 and 6")
+        day_text = day_list[start_day]
+        if end_day != start_day:
+            day_text += "-" + day_list[end_day]
+    hours_text = str(start_hour)
+    if end_hour != start_hour:
+        hours_text += "-" + str(end_hour)
+    return day_text, hours_text, str(minute), file
+
 def main():
     """Text UI for Scheduling playout of electronic chime sounds in .mp3 files.
 
-    Start a playout thread then enter an infinite while loop for user input. Wait
+    Start a playout process then enter an infinite while loop for user input. Wait
     on user input to build or maintain an unordered list of scheduled events. The
     user may request instructions, display any existing schedule, enter a line number
     followed by space-delimited parameters to add or replace an event, or enter a
-    line number alone to delete a scheduled event."""
+    line number alone to delete a scheduled event. At end of input, e.g. when
+    launched headless with no terminal, playout continues without the UI. Only
+    Ctrl-C exits, taking the playout process with it."""
 
-    # Start the playout thread as a non-daemon process
-    threading.Thread(target = playout,).start()
+    # Resume any schedule saved by a previous run
+    load_schedule()
+    # Start the playout process as a daemon process, so that it is terminated
+    # when main() exits. Its queues and initial schedule are passed explicitly
+    # so that it starts alike whether the platform forks or spawns it
+    playout_process = multiprocessing.Process(target = playout,
+                                              args = (schedule, cmd_q, state_q),
+                                              daemon = True)
+    playout_process.start()
+    # Exit cleanly on Ctrl-C, even while awaiting user input
+    signal.signal(signal.SIGINT, lambda *_: sys.exit(0))
     # Display user instructions
     show_instructions()
-    # Wait on and accept user-input continuously
-    #"You can check out any time you like, but you can never leave"
+    # Wait on and accept user-input continuously until Ctrl-C or end of input
     while True:
-        # Show schedule in case lines were renumbered
+        # Show schedule in case lines were renumbered, or playout removed one
+        receive_schedule()
         print("")
         show_schedule()
         while True:
@@ -59,177 +539,46 @@ def main():
                 # Prompt for user input then await it
                 print(">",end = "")
                 command = input()
+                # Split the line once into its five fields, leaving any spaces
+                # in the fifth (file name) field intact
+                parts = command.split(" ",4)
                 # ? shows instructions
-                if command.split(" ")[0] == "?":
+                if parts[0] == "?":
                     show_instructions()
                     break
                 # null line shows schedule
-                if command.split(" ")[0] == "":
-                    show_schedule()
+                if parts[0] == "":
                     break
                 # Otherwise, first user-input field must be a line number
-                if (command.split(" ")[0]).isnumeric():
-                    line_number = int(command.split(" ")[0])
+                if parts[0].isnumeric():
+                    line_number = int(parts[0])
                 else:
                     print("Error: Input must begin with a line number")
                     break
                 # Line number only is a request to delete
-                if len(command.split(" ")) == 1:
-                    # If there is anything to delete
-                    if len(schedule) >0:
-                        # Delete it
-                        try:
-                            schedule.pop(line_number-1)
-                        except:
-                            print("No line ",line_number," to delete")
+                if len(parts) == 1:
+                    send_command("del", line_number)
                     break
                 # Check for a complete entry, five single-spaced parameters  
-                if len(command.split(" "))<5:
+                if len(parts)<5:
                     print ("Error: Enter five items, separated by single space")
                     print (" Line# Day Hour(s) Minute and Tune")
                     break
-                # The second user input field is date, weekday, or weekday range
-                # User entered a hard date as mm/dd/yy
-                if "/" in command.split(" ")[1]:
-                    if len(command.split(" ")[1]) != 8:
-                        print("Error: Date must be mm/dd/yy")                       
-                        break
-                    # Convert to integer for validation
-                    month = int(command.split(" ")[1].split("/")[0])
-                    day = int(command.split(" ")[1].split("/")[1])
-                    year = int(command.split(" ")[1].split("/")[2])
-                    if month <0 or month >12:
-                        print("Error: ", month, " is not a valid month")
-                        break
-                    if day <0 or day>31:
-                        print("Error: ",day," is not a valid Day")
-                        break
-                    if year <21:
-                        print("Error: ",year," is not a valid Year")
-                        break
-                    # Date is valid, but retrieve the string to save in event
-                    date = command.split(" ")[1]
-                    # Make weekdays out of range to disable daily playout
-                    start_day = end_day = 8
-                # User entered a weekday or weekday range e.g. su, su-sa, etc.
-                else:
-                    # Weekday ranges are defined by a "-" delimiter
-                    days = command.split(" ")[1].split("-")
-                    # Convert first weekday in string to an integer start day index
-                    start_day = day_dict.get(days[0])
-                    # Default to a single weekday if not a weekday range
-                    end_day = start_day
-                    # Weekday range contains a second string
-                    if len(days) == 2:
-                        # Convert second weekday in string to an integer end day index
-                        end_day = day_dict.get(days[1])
-                    elif len(days)>2:
-                        print ("Error: Weekday list. Use multiple events instead")
-                        break
-                    # If the weekday is not in the dictionary
-                    if start_day == None or end_day == None:
-                        print ("Error: Day(s) must be su, mo, tu, we, th, fr or sa")
-                        break
-                    # User specified weekday(s) so null the hard date field in event
-                    date = ""
-                # The third user input field is an hour or hour range
-                hours = command.split(" ")[2]
-                start_hour = hours.split("-")[0]
-                # Default to single hour
-                end_hour = start_hour
-                # An hour range is delimited by "-"
-                if len(hours.split("-")) == 2:
-                    end_hour = hours.split("-")[1]
-                # Hour lists not supported
-                elif len(hours.split("-"))>2:
-                    print ("Error: Hour range must be start-end")
-                    break
-                # Convert start hour to integer for validation
-                if start_hour.isnumeric():
-                    start_hour = int(start_hour)
-                else:
-                    print("Start Hour(s) ", start_hour," must be numeric")
+                # Parse and validate the rest of the line into an event
+                event = parse_event(parts[1], parts[2], parts[3], parts[4])
+                if event == None:
                     break
-                if start_hour < 0 or start_hour > 23:
-                    print ("Start Hour ",start_hour," must between 0 and 23")
-                    break
-                # Convert end hour to integer for validation
-                if end_hour.isnumeric():
-                    end_hour = int(end_hour)
-                else:
-                    print("End Hour ",end_hour," must be numeric")
-                    break
-                if end_hour < 0 or end_hour > 23:
-                    print ("End Hour ", end_hour," must be between 0 and 23")
-                # The fourth user input field is a minute value, never a range
-                minute = command.split(" ")[3]
-                # Convert minute to integer for validation
-                if minute.isnumeric:
-                    minute = int(minute)
-                else:
-                    print ("Minute ",minute," must be numeric")
-                    break
-                if minute <0 or minute > 59:
-                    print ("Minute ",minute," must be between 0 and 59")
-                    break
-                # The fifth user input field is a file name (.mp3 file) which must
-                # allow for embedded spaces or the "Strike" keyword
-                file = command.split(" ",4)[4]
-                # The strike keyword is case insensitive and
-                # will be parsed into Strikexx.mp3 by the playout thread when used
-                if file.lower() == "strike":
-                    file_name = "Strike"
-                # Striking requires twelve Strikehh files
-                    for i in range(12):
-                        file_name = file_path + "Strike" + str(i+1)+".mp3"
-                        try:
-                            f = open(file_name, "r")
-                            if not f.readable():
-                                f.close()
-                                raise
-                                break
-                        except:
-                            print("Error: File ", file_name," is missing")
-                            break                    
-                # Validate the user-supplied file name
-                else:
-                    if file.lower().endswith(".mp3"):
-                        file_name = file_path+file
-                    else:
-                        file_name = file_path+file+".mp3"
-                    try:
-                        f = open(file_name, "r")
-                        if not f.readable():
-                            print("Error: ", file_name," is not readable")
-                            break
-                        f.close()
-                    except:
-                        print("Error:", file_name," not found - check sPeLLing")
-                        break
-
-                # The user's input line is fully parsed and validated
-                # No break out of inner while loop due to a user error
-                # Build an event list and insert or append it to schedule list
-                # An event is an ordered list of parameters of mixed types defining
-                # date, weekday or day range, hour or hour range, minute, and
-                # a filename or the keyword "Strike"
-                event = []
-                event.append(date) # nul for day range or hard date as mm/dd/yy string
-                event.append(start_day) # int starting weekday number
-                event.append(end_day) # int ending weekday number
-                event.append(start_hour) # int starting hour
-                event.append(end_hour) # int ending hour
-                event.append(minute) # int minute
-                event.append(file) # prepend path, append .mp3 at playout
-                
-                # Append the event to or insert into in the schedule 
-                if int(command.split(" ")[0])-1 >= len(schedule):
-                    schedule.append(event)
-                else:
-                    schedule[int(command.split(" ")[0])-1] = event
+                # Have playout append the event to or insert it into the schedule
+                send_command("add", line_number, event)
             #wend of main()
-            # Mop up any unanticipated error in parsing user input
-            except:
+            # End of input, e.g. stdin closed, so stop reading but keep the
+            # schedule playing until Ctrl-C
+            except EOFError:
+                playout_process.join()
+                return
+            # Mop up any unanticipated error in parsing user input but let
+            # Ctrl-C's exit through
+            except Exception:
                 print("Unanticipated Error: User input line discarded")
     # wend of user input loop
          
@@ -241,117 +590,115 @@ def show_schedule():
     numbers are prepended, new if an event has been deleted, to aid the user
     in editing"""
     
-    print('Day(s) Hr(s) Min Tune')
-    for i in range(0, len(schedule)):
-        print(i+1,end = '')
-        print(": ",end = '')
+    # Build every line of the display then print them all at once
+    lines = ['Day(s) Hr(s) Min Tune']
+    for i, event in enumerate(schedule):
         # The first item in the event may be a hard date string
-        if schedule[i][0] !=  "":
-            print(schedule[i][0],end = " ")
+        if event[0] !=  "":
+            days = event[0]
         # or it may be a weekday number or weekday number range
+        elif event[2]!= event[1]:
+            days = day_list[event[1]] + "-" + day_list[event[2]]
         else:
-            # Print the weekday or first weekday of a range
-            print(day_list[schedule[i][1]],end = '')
-            # and complete it if it's a range
-            if day_list[schedule[i][2]]!= day_list[schedule[i][1]]:
-                print ("-",end = '')
-                print(day_list[schedule[i][2]],end = ' ')
-            else:
-                print(" ",end = '')
-        # Display the event's hour or hour range        
-        print(schedule[i][3],end = '')
-        if schedule[i][3]!= schedule[i][4]:
-            print ("-",end = '')
-            print(schedule[i][4],end = ' ')
+            days = day_list[event[1]]
+        # The event's hour or hour range
+        if event[3]!= event[4]:
+            hours = str(event[3]) + "-" + str(event[4])
         else:
-            print(" ",end = "")
-        # Display the event's minute
-        print (schedule[i][5],end = " ")
-        # Finally display the strike keyword or file name
-        print (schedule[i][6])
+            hours = str(event[3])
+        # then the event's minute and finally the strike keyword or file name
+        lines.append(f"{i+1}: {days} {hours} {event[5]} {event[6]}")
+    print("\n".join(lines))
         
-def playout():
+def playout(initial_schedule, commands, states):
     """Playout .mp3 files from a schedule list at :00 per their respective time-stamps.
 
-    Upon launch or reawaken, the playout thread waits on the system minute, scans the
-    schedule list, and plays any entries. Upon completion of the last entry, it calculates
-    the time to the next system minute then requests sleep from the platform. Upon wake,
-    it waits for the system minute then scans again. Note that a playout of length exceeding
-    one minute may play instead of another event scheduled for that or the next minute.
-    In case an unanticipated user error makes its way into the schedule list or the
-    list is otherwise corrupted, an error is displayed, the event is removed from the
-    schedule, and both UI and playout continue."""
+    Run as a separate process from the UI, starting from initial_schedule and taking
+    changes to it from the commands queue, returning each changed schedule on the
+    states queue. The playout process keeps a heap of the next time each event is
+    to play and waits on changes until the earliest of them, then plays that event
+    and pushes the time it is next to play. Note that a playout of length exceeding
+    one minute may play instead of another event scheduled for that or the next
+    minute. In case a scheduled file cannot be played, an error is displayed, the
+    event is removed from the schedule, and both UI and playout continue."""
 
-    import datetime
+    # Ctrl-C is for the UI, which terminates this process as it exits
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    global cmd_q, state_q
+    cmd_q, state_q = commands, states
+    schedule[:] = initial_schedule
+    last_now = datetime.datetime.now()
+    rebuild_heap(last_now)
+    preload_audio()
     # Always keep running, even in the aftermath of user error
     while True:     
-        # Synchronize to the next even minute by waiting on it
-        while datetime.datetime.now().strftime("%S")!= "00":
-            pass
-        # Synchronized     
+        # Wait until the earliest event is due, applying schedule changes from the
+        # UI as they arrive. The delay is taken from the clock each time, and
+        # capped at a minute so that a change to the system clock is followed
+        now = datetime.datetime.now()
+        # The heap's times were taken from the clock as it was, so if it has been
+        # set back, e.g. at the end of daylight saving time, they would keep
+        # everything silent until it caught up. Rebuild the heap from now instead.
+        # Small steps back, e.g. an NTP correction just after an event played,
+        # are ignored, as a rebuild would play that event again
+        if now < last_now - datetime.timedelta(minutes = 1):
+            rebuild_heap(now)
+        last_now = now
+        delay = 60
+        if schedule_heap:
+            delay = min(delay, (schedule_heap[0][0] - now).total_seconds())
+        if delay > 0:
+            # Every event due by now has been popped, so after a change the
+            # heap is rebuilt from here
+            if apply_commands(delay):
+                rebuild_heap(now)
+            continue
+        # The earliest event is due, so push the time it is next to play
+        fire_time, i, event = heapq.heappop(schedule_heap)
+        next_time = next_fire_after(fire_time, event)
+        if next_time != None:
+            heapq.heappush(schedule_heap, (next_time, i, event))
+        # Skip it if a long playout, or the clock, has passed its minute
+        if now.replace(second = 0, microsecond = 0) != fire_time:
+            continue
+        # So if its a strike, pick this hour's strike file
+        if event[6] == "Strike":
+            # Strike 12 hour time, with 12 strikes at Noon and Midnight
+            hour =  fire_time.hour%12
+            if hour == 0:
+                hour = 12
+            file_name = event[7][hour-1]
+        # Its a previously validated and resolved file
+        else:
+            file_name = event[7]
+        # and play it. Play returns control only when play is done
         try:
-            # Scan all events in the schedule list
-            for i in range(0,len(schedule)):
-                # Parse for reasons why the ith event in the schedule isn't to be played or
-                # struck right now().  Continue immediately to the next schedule item in
-                # the for-loop if it isn't
-                # Event is on hard date, continue if not today
-                if schedule[i][0]!= "" and \
-                   datetime.datetime.now().strftime("%x")!= schedule[i][0]:
-                    continue
-                # Event is on a weekday range, continue if now() is before it
-                if schedule[i][1] <8 and \
-                   int((datetime.datetime.now().strftime("%w")).lower())<schedule[i][1]:
-                    continue
-                # ... or after it
-                if schedule[i][2] <8 and \
-                   int((datetime.datetime.now().strftime("%w")).lower())>schedule[i][2]:
-                    continue
-                # Continue if event is set for a later hour today
-                if int((datetime.datetime.now().strftime("%H")))<schedule[i][3]:
-                    continue
-                # ... or an earlier hour, so it must have already happened
-                if int((datetime.datetime.now().strftime("%H")))>schedule[i][4]:
-                    continue
-                # continue if not right this minute (and second)
-                if int((datetime.datetime.now().strftime("%M")))!= schedule[i][5]:
-                    continue
-                # All reasons a scheduled entry is not to be played now() have been cleared
-                # So if its a strike, build the strike file name and play the strikes
-                if schedule[i][6] == "Strike":
-                    # Strike 12 hour time, with 12 strikes at Noon and Midnight
-                    hour =  int(datetime.datetime.now().strftime("%H"))%12
-                    if hour == 0:
-                        hour = 12
-                    playsound(file_path+"Strike"+str(hour)+".mp3")   
-                # Its a previously validated file, so prepend the path, append the type,
-                # and play it
-                else:
-                    ##print("Playing ",file_path+schedule[i][6]+".mp3")
-                    playsound(file_path+schedule[i][6]+".mp3")
-                # Playsound returns control only when play is done
-                # wend of test for all parameters of the ith event or play it 
-            # end of for-next loop to examine all events in the schedule
-        # Mop up any oversignt in prior input validations or corruption of the schedule
-        # list. Display an error and the failed event then delete that event. Keep
-        # playout() running. Assume main() is still running, so display a replacement
-        # user input prompt after the error messages 
-        except:
-            print("Internal Error: A scheduled event could not be played")
-            print("Event ",i+1, schedule[i])
-            print("Event ",i+1," deleted. Resuming schedule")
+            ##print("Playing ",file_name)
+            play(file_name)
+        # Events are validated as they are added, so a failure here is of the
+        # file itself, e.g. removed or undecodable since. Display an error and
+        # the failed event then delete that event. Keep playout() running.
+        # Assume main() is still running, so display a replacement user input
+        # prompt after the error messages
+        except Exception as e:
+            print("Error: A scheduled event could not be played:", e)
+            if event in schedule:
+                i = schedule.index(event)
+                print("Event ",i+1, event[:7])
+                print("Event ",i+1," deleted. Resuming schedule")
+                schedule.pop(i)
+                # Drop only its entry, keeping those yet to play this minute
+                schedule_heap[:] = [entry for entry in schedule_heap
+                                    if entry[2] is not event]
+                heapq.heapify(schedule_heap)
+                return_schedule()
             show_schedule()
             print(">",end = "")
-            schedule.pop(i)
-        # All scheduled events checked and those for this minute played
-        # Nothing to do until the next :00 so put this playout thread to sleep
-        time.sleep(59-int(datetime.datetime.now().strftime("%S")))
-    # wend to keep playout thread from exiting unless main() is closed
+        # wend of waiting on, then playing, the earliest event
+    # wend to keep playout process from exiting unless main() is closed
     
-def show_instructions():
-    """Display instructions for the UI on stdout
-
-- Enter Line# Day(s) Hour(s) Minute and File Name or Strike..
+# User instructions, kept in one place for display by show_instructions()
+instructions = """- Enter Line# Day(s) Hour(s) Minute and File Name or Strike..
 - Separate line# and event parameters with a single space.
 - Day is mm/dd/yy, su, mo, tu, we, th, fr, or sa.
 - Hour is 24-hour time between 0 and 23.
@@ -359,17 +706,13 @@ def show_instructions():
 - Ranges are allowed and inclusive: 0-23 = hourly, su-sa = daily.
 - Tunes are filenames and are cAsE SeNsiTiVe.
 - Line#<enter> to delete a line.
-- ?<enter> to repeat these instructions"""
+- ?<enter> to repeat these instructions
+- Ctrl-C to exit"""
+
+def show_instructions():
+    """Display the instructions for the UI on stdout"""
     
-    print("""- Enter Line# Day(s) Hour(s) Minute and File Name or Strike..
-- Separate line# and event parameters with a single space.
-- Day is mm/dd/yy, su, mo, tu, we, th, fr, or sa.
-- Hour is 24-hour time between 0 and 23.
-- Minute is between 0 to 59.  Events play at hh:mm:00.
-- Ranges are allowed and inclusive: 0-23 = hourly, su-sa = daily.
-- Tunes are filenames and are cAsE SeNsiTiVe.
-- Line#<enter> to delete a line.
-- ?<enter> to repeat these instructions""")
+    print(instructions)
                         
 # Run main() as a standalone program
 if __name__ == "__main__":